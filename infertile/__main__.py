@@ -25,18 +25,48 @@
 # SOFTWARE.
 import sys
 import io
+import os
+import tempfile
+import time
 
 from infertile.ui.gui import UI
-from infertile.inferrer.generator import TilesetGenerator, Box
+from infertile.inferrer.generator import TilesetGenerator, Box, FILL_MODES, check_scale
+from infertile.inferrer.packer import AtlasPacker, save_atlas, save_pages
+from infertile.inferrer.profiling import MemoryProfiler, image_nbytes
+from infertile.inferrer.rules import BLOB_47, load_rules
+from infertile.inferrer.sheet import SpriteSheet, load_regions
 
 DESC_STR = """
-usage: infertile [-h] [--nogui x1 y1 x2 y2] [--input path] [--output path]
+usage: infertile [-h] [--nogui x1 y1 x2 y2] [--input path] [--output path] [--scales s1,s2,...]
+                 [--fill resize|tile] [--rules path] [--watch] [--sheet WxH | --regions path] [--jobs n]
+                 [--combined] [--parts-atlas] [--memory-report path] [--memory-budget MB]
 
 Arguments:
     -h --help                 show this message
     -n --nogui x1 y1 x2 y2    run on an input file with the given center box, with no gui
     -i --input path           specify input file
     -o --output path          specify output file
+    -s --scales s1,s2,...     comma-separated output scales, e.g. 1,2,4,0.5; every scale other than 1 is saved
+                              next to the output file, with an @<scale>x suffix
+    -f --fill resize|tile     how corners are filled with the middle and edges: stretched (default) or tiled
+    -r --rules path           use the autotiling rules from a JSON file instead of the built-in 47-tile ones
+    -w --watch                keep running and regenerate the output whenever the input file changes; only the
+                              tiles built from the changed parts of the image are redone. Requires --output
+    --sheet WxH               treat the input as a grid of pairs, each W by H pixels, all with the center box given
+                              to --nogui; every pair is saved as <output>_<row>_<column>. Requires --output
+    --regions path            treat the input as a sheet of pairs listed in a JSON file of
+                              {"name": ..., "region": [x1, y1, x2, y2], "box": [x1, y1, x2, y2]} objects; every pair
+                              is saved as <output>_<name>. Requires --output
+    -j --jobs n               number of pairs of a sheet to generate in parallel
+    --combined                pack all the pairs of a sheet into shared atlas pages, saved as <output>_<page>, with a
+                              <output>.json table of where every pair's tile for each neighborhood mask is, instead
+                              of saving one image per pair
+    --parts-atlas             save only the distinct parts the tiles are built from, as <output>_<page>, with a
+                              <output>.json table of how to assemble every tile from them. Requires --output
+    --memory-report path      record the memory used by every stage of the generation to a JSON file; with --sheet or
+                              --regions, the pairs are generated one at a time, and their stages recorded per pair
+    --memory-budget MB        keep the images held during the generation under the given number of megabytes by
+                              releasing them early; exits with status 1 if that's not enough
 """
 
 
@@ -45,6 +75,14 @@ def main(args=None):
     box_coords = []
     infile = None
     outfile = None
+    scales = [1]
+    fill_mode = 'resize'
+    watch_input = False
+    rules_path = None
+    parts_atlas = False
+    memory_report = None
+    memory_budget = None
+    sheet = {'cell_size': None, 'regions_path': None, 'jobs': 1, 'combined': False}
     if args is None:
         args = sys.argv[1:]
     argn = 0
@@ -62,8 +100,10 @@ def main(args=None):
                 argn += 1
                 continue
             except ValueError:
-                print("If --nogui is specified, the following four arguments must be integer pixel offsets.")
-                return
+                # The box can be left out when it's given per pair with --regions.
+                if box_coords:
+                    print("If --nogui is specified, the following four arguments must be integer pixel offsets.")
+                    return
         if args[argn] == '-i' or args[argn] == '--input':
             if argn < len(args):
                 infile = args[argn+1]
@@ -80,28 +120,352 @@ def main(args=None):
             else:
                 print("--output must be followed by the path to the input file!")
                 return
+        if args[argn] == '-s' or args[argn] == '--scales':
+            try:
+                scales = [parse_scale(scale) for scale in args[argn+1].split(',')]
+                argn += 2
+                continue
+            except IndexError:
+                print("--scales must be followed by a comma-separated list of scales!")
+                return
+            except ValueError:
+                print("--scales must be followed by a comma-separated list of whole numbers or 1/2, 1/4, 1/8, ... "
+                      "(like 1,2,4,0.5)!")
+                return
+        if args[argn] == '-f' or args[argn] == '--fill':
+            if argn + 1 < len(args) and args[argn+1] in FILL_MODES:
+                fill_mode = args[argn+1]
+                argn += 2
+                continue
+            else:
+                print("--fill must be followed by one of: {}!".format(", ".join(FILL_MODES)))
+                return
+        if args[argn] == '-r' or args[argn] == '--rules':
+            if argn + 1 < len(args):
+                rules_path = args[argn+1]
+                argn += 2
+                continue
+            else:
+                print("--rules must be followed by the path to the rules file!")
+                return
+        if args[argn] == '-w' or args[argn] == '--watch':
+            watch_input = True
+            argn += 1
+            continue
+        if args[argn] == '--sheet':
+            try:
+                sheet['cell_size'] = tuple(int(n) for n in args[argn+1].lower().split('x', 1))
+                assert len(sheet['cell_size']) == 2
+                argn += 2
+                continue
+            except (IndexError, ValueError, AssertionError):
+                print("--sheet must be followed by the cell size, like 64x32!")
+                return
+        if args[argn] == '--regions':
+            if argn + 1 < len(args):
+                sheet['regions_path'] = args[argn+1]
+                argn += 2
+                continue
+            else:
+                print("--regions must be followed by the path to the regions file!")
+                return
+        if args[argn] == '-j' or args[argn] == '--jobs':
+            try:
+                sheet['jobs'] = int(args[argn+1])
+                argn += 2
+                continue
+            except (IndexError, ValueError):
+                print("--jobs must be followed by the number of jobs!")
+                return
+        if args[argn] == '--memory-report':
+            if argn + 1 < len(args):
+                memory_report = args[argn+1]
+                argn += 2
+                continue
+            else:
+                print("--memory-report must be followed by the path to the report file!")
+                return
+        if args[argn] == '--memory-budget':
+            try:
+                memory_budget = int(float(args[argn+1]) * 1024 * 1024)
+                argn += 2
+                continue
+            except (IndexError, ValueError):
+                print("--memory-budget must be followed by a number of megabytes!")
+                return
+        if args[argn] == '--parts-atlas':
+            parts_atlas = True
+            argn += 1
+            continue
+        if args[argn] == '--combined':
+            sheet['combined'] = True
+            argn += 1
+            continue
         print(DESC_STR)
         return
-    if nogui:
-        cli(infile, outfile, box_coords)
+    if nogui and len(box_coords) != 4 and not sheet['regions_path']:
+        print("If --nogui is specified, the following four arguments must be integer pixel offsets.")
+        return
+    rules = load_rules(rules_path) if rules_path else BLOB_47
+    if nogui and (sheet['cell_size'] or sheet['regions_path']):
+        if watch_input or parts_atlas:
+            print("--sheet and --regions can't be used with --watch or --parts-atlas.")
+            return
+        if memory_report or memory_budget is not None:
+            if list(scales) != [1] or sheet['combined'] or sheet['jobs'] != 1:
+                print("--memory-report and --memory-budget can't be used with --scales, --combined or --jobs.")
+                return
+            if not profile_sheet_cli(infile, outfile, box_coords, fill_mode, rules, sheet['cell_size'],
+                                     sheet['regions_path'], memory_report, memory_budget):
+                sys.exit(1)
+            return
+        sheet_cli(infile, outfile, box_coords, scales, fill_mode, rules, **sheet)
+    elif nogui and (sheet['combined'] or sheet['jobs'] != 1):
+        print("--combined and --jobs require --sheet or --regions.")
+    elif nogui and (memory_report or memory_budget is not None):
+        if list(scales) != [1] or watch_input or parts_atlas:
+            print("--memory-report and --memory-budget can't be used with --scales, --watch or --parts-atlas.")
+            return
+        if not profile_cli(infile, outfile, box_coords, fill_mode, rules, memory_report, memory_budget):
+            sys.exit(1)
+    elif nogui:
+        cli(infile, outfile, box_coords, scales, fill_mode, rules, watch_input, parts_atlas)
     else:
         gui()
 
 
-def cli(infile, outfile, box):
+def cli(infile, outfile, box, scales=(1,), fill_mode='resize', rules=BLOB_47, watch_input=False, parts_atlas=False):
     generator = TilesetGenerator()
     generator.load_image(infile)
     generator.box = Box(*box)
-    tilelist = generator.get_tiling_sprite_list()
-    inferred_img = generator.get_tilelist_merged_into_single_image(tilelist)
+    generator.fill_mode = fill_mode
+    generator.rules = rules
+    if parts_atlas:
+        if not outfile:
+            print("--parts-atlas requires --output to be specified.")
+            return
+        if list(scales) != [1] or watch_input:
+            print("--parts-atlas can't be used with --scales or --watch.")
+            return
+        pages, table = generator.get_parts_atlas()
+        save_pages(pages, table, outfile)
+        return
+    if watch_input:
+        if not outfile:
+            print("--watch requires --output to be specified.")
+            return
+        watch(generator, infile, outfile, scales)
+        return
     if outfile:
-        inferred_img.save(outfile)
+        write_outputs(generator, outfile, scales)
+    elif list(scales) != [1]:
+        print("--scales requires --output to be specified.")
     else:
+        tilelist = generator.get_tiling_sprite_list()
+        inferred_img = generator.get_tilelist_merged_into_single_image(tilelist)
         bytearr = io.BytesIO()
         inferred_img.save(bytearr, format="PNG")
         sys.stdout.buffer.write(bytearr.getvalue())
 
 
+def profile_cli(infile, outfile, box, fill_mode='resize', rules=BLOB_47, memory_report=None, memory_budget=None):
+    """
+    Generate a tileset, recording the memory used per stage and holding it to the budget, if any.
+
+    :return: False if the budget was exceeded, True otherwise.
+    """
+    profiler = MemoryProfiler(memory_budget)
+    profiler.start()
+    try:
+        generator = TilesetGenerator()
+        with profiler.stage('load'):
+            generator.load_image(infile)
+            generator.source_img.load()
+            profiler.record_images(generator.get_image_memory())
+        generator.box = Box(*box)
+        generator.fill_mode = fill_mode
+        generator.rules = rules
+        profile_atlas(generator, outfile, profiler)
+    finally:
+        finish_profile(profiler, memory_report)
+    return check_budget(profiler)
+
+
+def profile_sheet_cli(infile, outfile, box, fill_mode='resize', rules=BLOB_47, cell_size=None, regions_path=None,
+                      memory_report=None, memory_budget=None):
+    """
+    Generate every pair of a sheet one after the other, saving each one before moving on to the next, and recording
+    the memory used per stage of every pair as ``<name>/<stage>``, holding it to the budget, if any.
+
+    :return: False if the budget was exceeded, True otherwise.
+    """
+    if not outfile:
+        print("--sheet and --regions require --output to be specified.")
+        return True
+    profiler = MemoryProfiler(memory_budget)
+    profiler.start()
+    try:
+        with profiler.stage('load'):
+            sheet = SpriteSheet(infile)
+            profiler.record_images(image_nbytes(sheet.source_img))
+        sheet.fill_mode = fill_mode
+        sheet.rules = rules
+        if regions_path:
+            regions = load_regions(regions_path)
+        else:
+            regions = sheet.grid_regions(cell_size, Box(*box))
+        root, ext = os.path.splitext(outfile)
+        for region in regions:
+            with profiler.group(region.name, image_nbytes(sheet.source_img)):
+                with profiler.stage('load'):
+                    generator = sheet.get_generator(region)
+                    profiler.record_images(generator.get_image_memory())
+                profile_atlas(generator, "{}_{}{}".format(root, region.name, ext), profiler)
+                del generator
+    finally:
+        finish_profile(profiler, memory_report)
+    return check_budget(profiler)
+
+
+def profile_atlas(generator, outfile, profiler):
+    inferred_img = generator.get_atlas(profiler=profiler)
+    with profiler.stage('encode'):
+        if outfile:
+            save_atomically(inferred_img, outfile)
+        else:
+            bytearr = io.BytesIO()
+            inferred_img.save(bytearr, format="PNG")
+            sys.stdout.buffer.write(bytearr.getvalue())
+
+
+def finish_profile(profiler, memory_report):
+    profiler.stop()
+    if memory_report:
+        profiler.save_report(memory_report)
+
+
+def check_budget(profiler):
+    if profiler.exceeded:
+        print("Memory budget of {} bytes exceeded: images held peaked at {} bytes.".format(
+            profiler.budget, profiler.retained_peak_image_bytes
+        ), file=sys.stderr)
+    return not profiler.exceeded
+
+
+def sheet_cli(infile, outfile, box, scales=(1,), fill_mode='resize', rules=BLOB_47, cell_size=None, regions_path=None,
+              jobs=1, combined=False):
+    if not outfile:
+        print("--sheet and --regions require --output to be specified.")
+        return
+    sheet = SpriteSheet(infile)
+    sheet.fill_mode = fill_mode
+    sheet.rules = rules
+    if regions_path:
+        regions = load_regions(regions_path)
+    else:
+        regions = sheet.grid_regions(cell_size, Box(*box))
+    if combined:
+        if list(scales) != [1]:
+            print("--combined can't be used with --scales.")
+            return
+        pages, lookup = sheet.pack(regions, AtlasPacker(), jobs)
+        save_atlas(pages, lookup, outfile)
+        return
+    root, ext = os.path.splitext(outfile)
+    for name, atlases in sheet.get_atlases(regions, scales, jobs).items():
+        for scale, img in atlases.items():
+            save_atomically(img, scaled_path("{}_{}{}".format(root, name, ext), scale))
+
+
+def write_outputs(generator, outfile, scales):
+    if list(scales) == [1]:
+        images = {1: generator.get_tilelist_merged_into_single_image(generator.get_tiling_sprite_list())}
+    else:
+        images = generator.get_scaled_atlases(scales)
+    for scale, img in images.items():
+        save_atomically(img, scaled_path(outfile, scale))
+
+
+def save_atomically(img, path):
+    """
+    Save an image to a temporary file next to the destination and move it into place, so anything watching the
+    destination never sees a half-written file.
+    """
+    directory, filename = os.path.split(os.path.abspath(path))
+    root, ext = os.path.splitext(filename)
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + root, suffix=ext or '.png', dir=directory)
+    os.close(fd)
+    try:
+        img.save(tmp_path)
+        # mkstemp creates files readable by the owner only; give the output the permissions a plain save would.
+        os.chmod(tmp_path, 0o666 & ~get_umask())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def get_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+def watch(generator, infile, outfile, scales, interval=0.05):
+    """
+    Poll the input file for changes, regenerating only what changed and rewriting the outputs every time it does.
+    Runs until interrupted.
+    """
+    write_outputs(generator, outfile, scales)
+    last_signature = file_signature(infile)
+    print("Watching {} for changes, press Ctrl+C to stop.".format(infile), file=sys.stderr)
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                signature = file_signature(infile)
+            except OSError:
+                # The file is being replaced; try again on the next poll.
+                continue
+            if signature == last_signature:
+                continue
+            last_signature = signature
+            start = time.perf_counter()
+            try:
+                changed = generator.reload_image(infile)
+                write_outputs(generator, outfile, scales)
+            except (OSError, SyntaxError, ValueError) as e:
+                # Most likely caught the file mid-write; it'll change again once the write is done.
+                print("Could not regenerate: {}".format(e), file=sys.stderr)
+                continue
+            print("Regenerated {} in {:.0f}ms".format(
+                "everything" if changed is None else "{} part(s)".format(len(changed)),
+                (time.perf_counter() - start) * 1000
+            ), file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def parse_scale(scale_str):
+    scale = float(scale_str)
+    check_scale(scale)
+    if scale == int(scale):
+        return int(scale)
+    return scale
+
+
+def scaled_path(path, scale):
+    if scale == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return "{}@{}x{}".format(root, scale, ext)
+
+
 def gui():
     UI().run()
 
@@ -23,18 +23,28 @@
 # LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
-import itertools
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 
 from PIL import Image
 
 from infertile.inferrer.neighborhood import Neighborhood
+from infertile.inferrer.packer import AtlasPacker
+from infertile.inferrer.profiling import MemoryProfiler, image_nbytes
+from infertile.inferrer.progress import GenerationCancelled, ProgressToken
+from infertile.inferrer.rules import BLOB_47, POSITIONS
 
-__all__ = ['Box', 'TilesetGenerator']
+__all__ = ['Box', 'TilesetGenerator', 'FILL_MODES']
 
 
 Box = namedtuple('Box', ('x1', 'y1', 'x2', 'y2'))
 
+# How the middle and edge textures are stretched over corners: scaled to the corner size, or repeated.
+FILL_MODES = ('resize', 'tile')
+
+# Layout of the merged tileset image: tiles go left to right, top to bottom, in rows of this many.
+ATLAS_COLUMNS = 6
+ATLAS_MIN_ROWS = 8
+
 
 class TilesetGenerator:
     def __init__(self):
@@ -44,6 +54,14 @@ class TilesetGenerator:
         self.box = Box(0, 0, self.w, self.h)
         self.generated_tiles = {}
         self.parts = {}
+        self.part_boxes = {}
+        self.parts_settings = None
+        self.tile_dependencies = {}
+        self.used_parts = None
+        self.fills = {}
+        self.fill_mode = 'resize'
+        self.rules = BLOB_47
+        self.scales = [1]
 
     def load_image(self, source_path):
         """
@@ -56,15 +74,83 @@ class TilesetGenerator:
 
         :param source_path: Path to the image.
         """
-        self.source_img = Image.open(source_path)
+        self.set_image(Image.open(source_path))
+
+    def set_image(self, image):
+        """
+        Use an already decoded image as the source and reset all stored image-specific data.
+        See :py:meth:`.load_image` for the layout the image should have.
+
+        :type image: Image
+        """
+        if image.size[0] % 2 != 0:
+            raise ValueError("Image should be split into two equal parts - width is not even.")
+        self.source_img = image
         self.w = self.source_img.size[0]
         self.h = self.source_img.size[1]
-        if self.w % 2 != 0:
-            raise ValueError("Image should be split into two equal parts - width is not even.")
         self.generated_tiles = {}
+        self.tile_dependencies = {}
         self.parts = {}
+        self.part_boxes = {}
+        self.parts_settings = None
+        self.fills = {}
+
+    def reload_image(self, source_path):
+        """
+        Load a new version of the source image, keeping every part - and every tile built only from parts - that
+        didn't change. If the size or mode of the image changed, everything is reset like in :py:meth:`.load_image`.
 
-    def generate_parts(self):
+        :param source_path: Path to the image.
+        :return: Set of the keys of the parts that changed, or None if everything was reset.
+        :rtype: set[str]|None
+        """
+        image = Image.open(source_path)
+        image.load()
+        if not self.parts or self.source_img is None or (image.size, image.mode) != (self.source_img.size,
+                                                                                    self.source_img.mode):
+            self.set_image(image)
+            return None
+        self.source_img = image
+        changed = set()
+        for key, box in self.part_boxes.items():
+            part = image.crop(box)
+            if part.tobytes() != self.parts[key].tobytes():
+                self.parts[key] = part
+                changed.add(key)
+        if changed:
+            self.fills = {fill_key: fill for fill_key, fill in self.fills.items()
+                          if (fill_key[0] if isinstance(fill_key, tuple) else fill_key) not in changed}
+            for tile_key, dependencies in list(self.tile_dependencies.items()):
+                if dependencies & changed:
+                    del self.tile_dependencies[tile_key]
+                    self.generated_tiles.pop(tile_key, None)
+        return changed
+
+    def release_intermediates(self):
+        """
+        Drop the parts, fills and generated tiles, freeing their memory. They're regenerated on the next call to
+        :py:meth:`.get_tiling_sprite_list`.
+        """
+        self.generated_tiles = {}
+        self.tile_dependencies = {}
+        self.parts = {}
+        self.part_boxes = {}
+        self.parts_settings = None
+        self.fills = {}
+
+    def get_image_memory(self):
+        """
+        Estimate how much memory the images held by the generator - the source, parts, fills and generated tiles -
+        take up.
+
+        :return: Number of bytes.
+        :rtype: int
+        """
+        images = [self.source_img] if self.source_img is not None else []
+        images += list(self.parts.values()) + list(self.fills.values()) + list(self.generated_tiles.values())
+        return sum(image_nbytes(image) for image in images)
+
+    def generate_parts(self, progress=None):
         """
         Split the image into the 18 parts we're using to generate the complete tileset and save them to self.parts.
         Parts are designated as ``curve + umd + rml``, where ``curve`` is either convex::
@@ -80,7 +166,19 @@ class TilesetGenerator:
         ``umd`` is one of "u", "m", or "d"; designating which horizontal third (upper, middle, or lower) of the sprite
          the part belongs to, and ``lmr`` is, likewise, one of "r", "m" or "l", designating the horizontal third (left,
          middle, or right).
+
+        The parts are only stored once all of them are done, so a cancelled call leaves no half-split image behind.
+
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
         """
+        if progress is None:
+            progress = ProgressToken()
+        self.fills = {}
+        self.generated_tiles = {}
+        self.tile_dependencies = {}
+        parts = {}
+        part_boxes = {}
         for half, curve in enumerate(("convex", "concave")):
             for umd, y_start, y_end in (("u", 0, self.box.y1),
                                         ("m", self.box.y1, self.box.y2),
@@ -92,38 +190,282 @@ class TilesetGenerator:
                               y_start,
                               int(half * self.w / 2) + x_end,
                               y_end)
-                    self.parts[curve + umd + lmr] = self.source_img.crop(box)
+                    part_boxes[curve + umd + lmr] = box
+                    parts[curve + umd + lmr] = self.source_img.crop(box)
+                    progress.update('parts', len(parts), 18)
+        self.parts = parts
+        self.part_boxes = part_boxes
+        self.parts_settings = (self.box, self.fill_mode, self.rules)
+
+    def ensure_parts(self, progress=None):
+        """
+        Generate the parts, unless they're already there and the box, fill mode and rules haven't changed since.
+
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        """
+        if not self.parts or self.parts_settings != (self.box, self.fill_mode, self.rules):
+            self.generate_parts(progress)
 
-    def get_tiling_sprite_list(self):
+    def get_tiling_sprite_list(self, progress=None):
         """
         Generate all possible combinations of neighboring tiles - a neighboring tile is either empty or filled.
-        Populates self.generated_tiles.
+        Populates self.generated_tiles. Parts and tiles are only regenerated if the box, fill mode or rules changed
+        since the last call. If the generation gets cancelled, all the intermediate images are released.
 
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
         :return: List of all the tiles in the generated tileset.
         :rtype: list[Image]
+        :raises GenerationCancelled: if ``progress`` gets cancelled.
+        """
+        if progress is None:
+            progress = ProgressToken()
+        try:
+            self.ensure_parts(progress)
+            neighborhoods = get_all_neighborhoods(self.rules)
+            tile_list = []
+            for neighborhood in neighborhoods:
+                tile_list.append(self.get_tile(neighborhood))
+                progress.update('tiles', len(tile_list), len(neighborhoods))
+            return tile_list
+        except GenerationCancelled:
+            self.release_intermediates()
+            raise
+
+    def get_scaled_atlases(self, scales=None, progress=None):
+        """
+        Generate the merged tileset image at several scales, extracting the parts only once.
+
+        Integer upscales are done with nearest-neighbor on the parts and fills, before composing the tiles, so pixel art
+        stays crisp and every upscale is an exact pixel multiple of the full resolution tileset. Downscales have to be
+        1/2, 1/4, 1/8, ... and form a mip chain, each level being the previous one halved, starting from the full
+        resolution image.
+
+        :type scales: list[int|float]
+        :param scales: Scales to generate; defaults to ``self.scales``.
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :return: Dictionary mapping each requested scale to the merged tileset image.
+        :rtype: dict[int|float: Image]
+        :raises GenerationCancelled: if ``progress`` gets cancelled; the intermediate images are released first.
         """
-        self.generate_parts()
-        # Equivalent to generating all 8-bit numbers represented as lists of booleans.
-        combinations = itertools.product([True, False], repeat=8)
-        # Set, so there's no duplicates
-        neighborhoods = {Neighborhood.from_iterable(nb_list) for nb_list in combinations}
-        tile_list = []
-        for neighborhood in sorted(neighborhoods, key=lambda nb: nb.to_string().count('1')):
-            tile_list.append(self.get_tile(neighborhood))
-        return tile_list
+        if scales is None:
+            scales = self.scales
+        if progress is None:
+            progress = ProgressToken()
+        for scale in scales:
+            check_scale(scale)
+        try:
+            upscales = sorted({scale for scale in scales if scale >= 1})
+            downscales = sorted({scale for scale in scales if scale < 1}, reverse=True)
+
+            atlases = {}
+            total = len(upscales) + len(downscales)
+            full_size = self.get_tilelist_merged_into_single_image(self.get_tiling_sprite_list(progress), progress)
+            full_parts = self.parts
+            for scale in upscales:
+                if scale != 1:
+                    scaled_parts = {key: upscale_image(part, int(scale)) for key, part in full_parts.items()}
+                    # Scale the full resolution fills too, instead of resampling the scaled parts all over again.
+                    full_fills = self.fills
+                    scaled_fills = {}
+                    for fill_key, fill in full_fills.items():
+                        if isinstance(fill_key, tuple):
+                            part_key, (w, h) = fill_key
+                            fill_key = (part_key, (w * int(scale), h * int(scale)))
+                        scaled_fills[fill_key] = upscale_image(fill, int(scale))
+                    self.parts, self.fills = scaled_parts, scaled_fills
+                    try:
+                        neighborhoods = get_all_neighborhoods(self.rules)
+                        tilelist = []
+                        for neighborhood in neighborhoods:
+                            tilelist.append(self.infer_tile(neighborhood))
+                            progress.update('tiles', len(tilelist), len(neighborhoods))
+                    finally:
+                        self.parts, self.fills = full_parts, full_fills
+                    atlases[scale] = self.get_tilelist_merged_into_single_image(tilelist, progress)
+                else:
+                    atlases[1] = full_size
+                progress.update('scales', len(atlases), total)
+
+            mip, mip_scale = full_size, 1
+            for scale in downscales:
+                while mip_scale > scale:
+                    mip = mip.resize((max(1, mip.size[0] // 2), max(1, mip.size[1] // 2)), Image.BOX)
+                    mip_scale /= 2
+                atlases[scale] = mip
+                progress.update('scales', len(atlases), total)
+            return atlases
+        except GenerationCancelled:
+            self.release_intermediates()
+            raise
+
+    def get_atlas(self, progress=None, profiler=None):
+        """
+        Generate the merged tileset image, recording the memory used by every stage: ``parts``, ``tiles`` - generating
+        the tiles and pasting each one into the atlas as soon as it's done - and ``atlas`` - the finished atlas, after
+        releasing whatever the budget calls for.
+
+        If the profiler has a budget, all the generated tiles are dropped whenever the images held go over it, as
+        they're already in the atlas; the parts and fills are released after the atlas is done, too. Without one,
+        everything is kept for later calls.
+
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :type profiler: MemoryProfiler
+        :param profiler: Profiler to record the stages to.
+        :return: The merged tileset image, like from :py:meth:`.get_tilelist_merged_into_single_image`.
+        :rtype: Image
+        :raises GenerationCancelled: if ``progress`` gets cancelled.
+        """
+        if progress is None:
+            progress = ProgressToken()
+        if profiler is None:
+            profiler = MemoryProfiler()
+        try:
+            with profiler.stage('parts'):
+                self.ensure_parts(progress)
+                profiler.record_images(self.get_image_memory())
+
+            with profiler.stage('tiles'):
+                neighborhoods = get_all_neighborhoods(self.rules)
+                tilewidth, tileheight = int(self.w / 2), self.h
+                atlas = self.new_atlas_image((tilewidth, tileheight), len(neighborhoods))
+                for i, neighborhood in enumerate(neighborhoods):
+                    atlas.paste(self.get_tile(neighborhood), get_atlas_position((tilewidth, tileheight), i))
+                    if profiler.over_budget(self.get_image_memory() + image_nbytes(atlas)):
+                        self.generated_tiles = {}
+                        self.tile_dependencies = {}
+                    profiler.record_images(self.get_image_memory() + image_nbytes(atlas))
+                    progress.update('tiles', i + 1, len(neighborhoods))
+
+            with profiler.stage('atlas'):
+                if profiler.over_budget(self.get_image_memory() + image_nbytes(atlas)):
+                    self.release_intermediates()
+                profiler.record_images(self.get_image_memory() + image_nbytes(atlas))
+        except GenerationCancelled:
+            self.release_intermediates()
+            raise
+        return atlas
 
     def get_tile(self, neighborhood):
         """
         Get a sprite for a given neighborhood, generating it if it doesn't exist. Populates self.generated_tiles.
+        The neighborhood is normalized with ``self.rules``, so it should not be normalized beforehand.
 
         :param neighborhood: Neighborhood object to get a sprite for
         :type neighborhood: Neighborhood
         :return: Generated/fetched sprite for the neighborhood.
         :rtype: Image
         """
-        if neighborhood not in self.generated_tiles:
-            self.generated_tiles[neighborhood.to_string()] = self.infer_tile(neighborhood)
-        return self.generated_tiles[neighborhood.to_string()]
+        self.ensure_parts()
+        key = "{0:08b}".format(self.rules.normalize(neighborhood.to_int()))
+        if key not in self.generated_tiles:
+            self.used_parts = set()
+            try:
+                self.generated_tiles[key] = self.infer_tile(neighborhood)
+                self.tile_dependencies[key] = self.used_parts
+            finally:
+                self.used_parts = None
+        return self.generated_tiles[key]
+
+    def get_parts_atlas(self, packer=None, progress=None):
+        """
+        Pack only the distinct sections the tiles are built from, and describe how to assemble every tile from them,
+        so tiles can be composed at load time or in a shader instead of being stored whole.
+
+        The table holds the ``tile_size``, the ``normalization`` list mapping every one of the 256 neighborhood masks
+        to a normalized one, and ``tiles``, mapping every normalized mask to a list of
+        ``[page, x, y, w, h, dst_x, dst_y]`` entries: a rect of the atlas, and where in the tile it goes.
+
+        :type packer: AtlasPacker
+        :param packer: Packer to use, with no tilesets added yet; defaults to an AtlasPacker with default settings.
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :return: Tuple of the atlas pages and the table.
+        :rtype: (list[Image], dict)
+        :raises GenerationCancelled: if ``progress`` gets cancelled; the intermediate images are released first.
+        """
+        if packer is None:
+            packer = AtlasPacker()
+        if progress is None:
+            progress = ProgressToken()
+        try:
+            self.ensure_parts(progress)
+            xs = {'l': 0, 'm': self.box.x1, 'r': self.box.x2}
+            ys = {'u': 0, 'm': self.box.y1, 'd': self.box.y2}
+            sections = OrderedDict()
+            compositions = OrderedDict()
+            for mask in self.rules.tile_masks:
+                entries = []
+                for position, source in zip(POSITIONS, self.rules.compositions[mask]):
+                    # Fills are cropped differently depending on the corner, plain parts look the same everywhere.
+                    section_key = (source.part, position if source.fill else None)
+                    if section_key not in sections:
+                        sections[section_key] = self.get_section(position, source)
+                    if sections[section_key].size[0] and sections[section_key].size[1]:
+                        entries.append((section_key, position))
+                compositions[mask] = entries
+                progress.update('tiles', len(compositions), len(self.rules.tile_masks))
+
+            packed_keys = [key for key, section in sections.items() if section.size[0] and section.size[1]]
+            packer.add_tileset('sections', [sections[key] for key in packed_keys])
+            pages, lookup = packer.pack(progress)
+            rects = dict(zip(packed_keys, lookup['sections']))
+            tiles = OrderedDict()
+            for mask, entries in compositions.items():
+                tiles[str(mask)] = [list(rects[section_key]) + [xs[position[1]], ys[position[0]]]
+                                    for section_key, position in entries]
+            table = OrderedDict([('tile_size', [int(self.w / 2), self.h]),
+                                 ('normalization', list(self.rules.normalization)),
+                                 ('tiles', tiles)])
+            return pages, table
+        except GenerationCancelled:
+            self.release_intermediates()
+            raise
+
+    def render_map(self, grid, progress=None):
+        """
+        Render a map, picking every cell's tile with ``self.rules``. Only the tiles the map uses get generated.
+
+        :type grid: list[list[bool]]
+        :param grid: Rows of cells, truthy where filled.
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :return: Image of the map, with empty cells left blank.
+        :rtype: Image
+        :raises GenerationCancelled: if ``progress`` gets cancelled; the intermediate images are released first.
+        """
+        if progress is None:
+            progress = ProgressToken()
+        try:
+            self.ensure_parts(progress)
+            masks = self.rules.get_map_masks(grid)
+            tilewidth, tileheight = int(self.w / 2), self.h
+            width = len(masks[0]) if masks else 0
+            result = Image.new(self.source_img.mode, (tilewidth * width, tileheight * len(masks)))
+            for y, row in enumerate(masks):
+                for x, mask in enumerate(row):
+                    if mask is not None:
+                        result.paste(self.get_tile(Neighborhood.from_int(mask, normalize=False)),
+                                     (x * tilewidth, y * tileheight))
+                progress.update('map', y + 1, len(masks))
+            return result
+        except GenerationCancelled:
+            self.release_intermediates()
+            raise
+
+    def get_part(self, key):
+        """
+        Get one of the parts from self.parts, noting it as a dependency of the tile being generated, if any.
+
+        :type key: str
+        :rtype: Image
+        """
+        if self.used_parts is not None:
+            self.used_parts.add(key)
+        return self.parts[key]
 
     def infer_tile(self, neighborhood):
         """
@@ -140,7 +482,8 @@ class TilesetGenerator:
 
     def get_tile_parts(self, neighborhood):
         """
-        Get the 9 sections (images) needed to generate the tile for a given neighborhood.
+        Get the 9 sections (images) needed to generate the tile for a given neighborhood, as listed in the composition
+        table of ``self.rules``.
 
         :param neighborhood: Neighborhood object to get the parts for the tile for
         :type neighborhood: Neighborhood
@@ -149,22 +492,8 @@ class TilesetGenerator:
                  one of 'r', 'm', 'l' and indicating the horizontal position
         :rtype: dict[str: Image]
         """
-        # Fill the center with, well, the center.
-        sprite_parts = {'mm': self.parts['convexmm']}
-        for umd in "ud":
-            # We can just reuse the top and bottom middle parts
-            sprite_parts[umd + 'm'] = self.parts['{curve}{y}m'.format(
-                curve='concave' if neighborhood[umd + 'm'] else 'convex',
-                y=umd
-            )]
-            for lmr in "lr":
-                # center cross
-                sprite_parts['m' + lmr] = self.parts['{curve}m{x}'.format(
-                    curve='concave' if neighborhood['m' + lmr] else 'convex',
-                    x=lmr
-                )]
-                sprite_parts[umd + lmr] = self.get_corner(umd, lmr, neighborhood)
-        return sprite_parts
+        composition = self.rules.get_composition(neighborhood.to_int())
+        return {position: self.get_section(position, source) for position, source in zip(POSITIONS, composition)}
 
     def get_corner(self, umd, lmr, neighborhood):
         """
@@ -180,26 +509,59 @@ class TilesetGenerator:
         :return: Corner of the generated tile
         :rtype: Image
         """
-        corner_size = self.parts['concave' + umd + lmr].size
-        # No diagonal neighbor at the corner
-        if not neighborhood[umd + lmr]:
-            # Sanity check; the Neighborhood should be normalized, but it doesn't hurt to make sure
-            # No diagonal neighbor, both non-diagonal neighbors: concave corner.
-            if neighborhood[umd + 'm'] and neighborhood['m' + lmr]:
-                return self.parts['concave' + umd + lmr]
-        # All neighbors - fill it out with the middle.
-        if neighborhood[umd + 'm'] and neighborhood['m' + lmr]:
-            # ToDo: tile the middle instead of resizing it
-            return self.parts['concavemm'].resize(corner_size)
-        # Only the vertical neighbor present - vertical edge.
-        elif neighborhood[umd + 'm']:
-            return self.parts['convexm' + lmr].resize(corner_size)
-        # Only the horizontal neighbor present - horizontal edge.
-        elif neighborhood['m' + lmr]:
-            return self.parts['convex' + umd + 'm'].resize(corner_size)
-        # No neighbors - just grab the convex corner.
-        else:
-            return self.parts['convex' + umd + lmr]
+        composition = self.rules.get_composition(neighborhood.to_int())
+        return self.get_section(umd + lmr, composition[POSITIONS.index(umd + lmr)])
+
+    def get_section(self, position, source):
+        """
+        Get the image for one of the 9 sections of a tile.
+
+        :type position: str
+        :param position: Position key of the section, like in :py:meth:`.get_tile_parts`.
+        :type source: PartSource
+        :param source: Part the section is made of, and whether it has to be stretched over the section.
+        :rtype: Image
+        """
+        if source.fill:
+            return self.get_fill(source.part, position[0], position[1], self.parts['concave' + position].size)
+        return self.get_part(source.part)
+
+    def get_fill(self, part_key, umd, lmr, size):
+        """
+        Get a part stretched over a corner of the given size, according to ``self.fill_mode``.
+
+        Fills are computed once per set of parts and cached in ``self.fills``; with the ``tile`` mode, a single buffer
+        of the part repeated enough times to cover any corner is built, and every corner gets a crop of it, aligned so
+        that the texture continues seamlessly into the middle of the tile.
+
+        :type part_key: str
+        :param part_key: Key of the part in ``self.parts`` to fill the corner with.
+        :type umd: str
+        :param umd: one of "u" or "d"; the vertical position of the corner being filled.
+        :type lmr: str
+        :param lmr: one of "l" or "r"; the horizontal position of the corner being filled.
+        :type size: (int, int)
+        :param size: Size of the corner.
+        :return: Part resized or tiled to the requested size.
+        :rtype: Image
+        """
+        if self.fill_mode not in FILL_MODES:
+            raise ValueError("Unknown fill mode {}, should be one of: {}.".format(self.fill_mode,
+                                                                                  ", ".join(FILL_MODES)))
+        part = self.get_part(part_key)
+        if self.fill_mode == 'resize':
+            if (part_key, size) not in self.fills:
+                self.fills[part_key, size] = part.resize(size)
+            return self.fills[part_key, size]
+        if part_key not in self.fills:
+            corner_sizes = [self.parts['concave' + y + x].size for y in "ud" for x in "lr"]
+            self.fills[part_key] = tile_image(part,
+                                              (max(w for w, _ in corner_sizes), max(h for _, h in corner_sizes)))
+        buffer = self.fills[part_key]
+        # Upper and left corners sit before the middle, so their fill has to end where the pattern repeats.
+        x = buffer.size[0] - size[0] if lmr == 'l' else 0
+        y = buffer.size[1] - size[1] if umd == 'u' else 0
+        return buffer.crop((x, y, x + size[0], y + size[1]))
 
     def merge_tile_parts(self, tile_parts):
         """
@@ -210,7 +572,9 @@ class TilesetGenerator:
         :return: Complete tile image
         :rtype: Image
         """
-        tile = Image.new(self.source_img.mode, (int(self.w / 2), self.h))
+        tile_size = (sum(tile_parts['u' + lmr].size[0] for lmr in "lmr"),
+                     sum(tile_parts[umd + 'm'].size[1] for umd in "umd"))
+        tile = Image.new(self.source_img.mode, tile_size)
         yoffset = 0
         for umd in "umd":
             xoffset = 0
@@ -221,17 +585,90 @@ class TilesetGenerator:
             yoffset += tile_parts[umd+'m'].size[1]
         return tile
 
-    def get_tilelist_merged_into_single_image(self, tilelist):
-        result = Image.new(self.source_img.mode, (self.w * 3, self.h * 8))
-        tilewidth = int(self.w / 2)
-        i = 0
-        for y in range(8):
-            for x in range(6):
-                try:
-                    startx, starty = tilewidth * x, self.h * y
-                    endx, endy = startx + tilewidth, starty + self.h
-                    result.paste(tilelist[i], (startx, starty, endx, endy))
-                    i += 1
-                except IndexError:
-                    return result
+    def get_tilelist_merged_into_single_image(self, tilelist, progress=None):
+        if progress is None:
+            progress = ProgressToken()
+        tile_size = tilelist[0].size
+        result = self.new_atlas_image(tile_size, len(tilelist))
+        for i, tile in enumerate(tilelist):
+            result.paste(tile, get_atlas_position(tile_size, i))
+            progress.update('atlas', i + 1, len(tilelist))
         return result
+
+    def new_atlas_image(self, tile_size, count):
+        """
+        Create the blank merged tileset image, laid out :py:data:`ATLAS_COLUMNS` tiles wide and at least
+        :py:data:`ATLAS_MIN_ROWS` tiles high.
+
+        :type tile_size: (int, int)
+        :param tile_size: Size of a single tile.
+        :type count: int
+        :param count: Number of tiles the image has to hold.
+        :rtype: Image
+        """
+        rows = max(ATLAS_MIN_ROWS, -(-count // ATLAS_COLUMNS))
+        return Image.new(self.source_img.mode, (tile_size[0] * ATLAS_COLUMNS, tile_size[1] * rows))
+
+def get_atlas_position(tile_size, index):
+    """
+    :type tile_size: (int, int)
+    :type index: int
+    :return: Top left corner of the ``index``-th tile in the merged tileset image.
+    :rtype: (int, int)
+    """
+    return tile_size[0] * (index % ATLAS_COLUMNS), tile_size[1] * (index // ATLAS_COLUMNS)
+
+
+def check_scale(scale):
+    """
+    Check that an output scale is either a whole number, or one of 1/2, 1/4, 1/8, ...
+
+    :type scale: int|float
+    :raises ValueError: if it isn't.
+    """
+    if scale >= 1:
+        if scale != int(scale):
+            raise ValueError("Upscales should be integers, got {}.".format(scale))
+    elif scale <= 0 or (1 / scale) != int(1 / scale) or int(1 / scale) & (int(1 / scale) - 1):
+        raise ValueError("Downscales should be 1/2, 1/4, 1/8, ..., got {}.".format(scale))
+
+
+def upscale_image(image, scale):
+    """
+    :type image: Image
+    :type scale: int
+    :return: The image scaled up by a whole factor, with nearest-neighbor.
+    :rtype: Image
+    """
+    return image.resize((image.size[0] * scale, image.size[1] * scale), Image.NEAREST)
+
+
+def tile_image(image, min_size):
+    """
+    Repeat an image in both directions, so that it covers at least the given size, ending at a whole repetition.
+
+    :type image: Image
+    :type min_size: (int, int)
+    :return: Image made of the source image repeated a whole number of times horizontally and vertically.
+    :rtype: Image
+    """
+    w, h = image.size
+    columns = max(1, -(-min_size[0] // max(w, 1)))
+    rows = max(1, -(-min_size[1] // max(h, 1)))
+    result = Image.new(image.mode, (w * columns, h * rows))
+    for y in range(rows):
+        for x in range(columns):
+            result.paste(image, (x * w, y * h))
+    return result
+
+
+def get_all_neighborhoods(rules=BLOB_47):
+    """
+    Generate all possible combinations of neighboring tiles - a neighboring tile is either empty or filled.
+
+    :type rules: infertile.inferrer.rules.CompiledRules
+    :param rules: Rules deciding which neighborhoods get distinct tiles.
+    :return: List of all the distinct normalized neighborhoods, in tileset order.
+    :rtype: list[Neighborhood]
+    """
+    return [Neighborhood.from_int(mask, normalize=False) for mask in rules.tile_masks]
@@ -30,14 +30,17 @@ __all__ = ['Neighborhood']
 class Neighborhood:
 
     @classmethod
-    def from_iterable(cls, iterable):
+    def from_iterable(cls, iterable, normalize=True):
         """
         Parse an iterable into a Neighborhood object.
 
         :type iterable: Iterable
         :param iterable: Iterable of booleans, indicating whether there's a neighboring tile, in left-to-right,
                          top-to-bottom order.
-        :return: Normalized Neighborhood object
+        :type normalize: bool
+        :param normalize: Whether to :py:meth:`.normalize` the neighborhood with the built-in 47-tile rules. Turn it
+                          off when passing it on to a TilesetGenerator, which normalizes with its own rule set.
+        :return: Neighborhood object, normalized unless asked otherwise
         :rtype: Neighborhood
         """
         neighborhood = cls()
@@ -47,34 +50,41 @@ class Neighborhood:
                 if x + y != 'mm':  # The center tile is not a neighbor, it's the tile we're generating!
                     # Fill the list
                     neighborhood[y + x] = neighbors_list.pop(0)
-        neighborhood.normalize()
+        if normalize:
+            neighborhood.normalize()
         return neighborhood
 
     @classmethod
-    def from_int(cls, neighborhood_int):
+    def from_int(cls, neighborhood_int, normalize=True):
         """
         Parse an 8-bit integer into a neighborhood object.
 
         :type neighborhood_int: int
         :param neighborhood_int: Integer, where each binary digit indicates whether there's a neighboring tile there, in
                                  left-to-right, top-to-bottom order.
-        :return: Normalized Neighborhood object
+        :type normalize: bool
+        :param normalize: Whether to :py:meth:`.normalize` the neighborhood with the built-in 47-tile rules. Turn it
+                          off when passing it on to a TilesetGenerator, which normalizes with its own rule set.
+        :return: Neighborhood object, normalized unless asked otherwise
         :rtype: Neighborhood
         """
-        return cls.from_string("{0:b}".format(neighborhood_int))
+        return cls.from_string("{0:08b}".format(neighborhood_int), normalize)
 
     @classmethod
-    def from_string(cls, neighborhood_str):
+    def from_string(cls, neighborhood_str, normalize=True):
         """
         Parse a string of 8 binary digits into a neighborhood object.
 
         :type neighborhood_str: str
         :param neighborhood_str: String of 8 binary digits, where each character indicates whether there's a neighboring
                                  tile there, in left-to-right, top-to-bottom order.
-        :return: Normalized Neighborhood object
+        :type normalize: bool
+        :param normalize: Whether to :py:meth:`.normalize` the neighborhood with the built-in 47-tile rules. Turn it
+                          off when passing it on to a TilesetGenerator, which normalizes with its own rule set.
+        :return: Neighborhood object, normalized unless asked otherwise
         :rtype: Neighborhood
         """
-        return cls.from_iterable([bool(int(ch)) for ch in neighborhood_str])
+        return cls.from_iterable([bool(int(ch)) for ch in neighborhood_str], normalize)
 
     def __init__(self):
         # Enable in PyCharm > Preferences > Editor > Code Style > Formatter Control
@@ -86,7 +96,8 @@ class Neighborhood:
 
     def normalize(self):
         """
-        Normalize neighborhood, discarding unimportant neighbors.
+        Normalize neighborhood, discarding unimportant neighbors, following the built-in 47-tile rules. Other rule sets
+        normalize masks with :py:meth:`CompiledRules.normalize` instead.
         Notice that the following tile, marked with an X (a ``#`` denotes a neighbor)::
             #..
             .X#
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# vim: ai ts=4 sts=4 et sw=4 ft=python
+#
+# # Released under MIT License
+#
+# Copyright (c) 2017 Slavfox.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import hashlib
+import json
+import os
+from collections import OrderedDict, namedtuple
+
+from PIL import Image
+
+from infertile.inferrer.progress import ProgressToken
+
+__all__ = ['AtlasRect', 'AtlasPacker', 'save_atlas', 'save_pages']
+
+
+AtlasRect = namedtuple('AtlasRect', ('page', 'x', 'y', 'w', 'h'))
+
+
+class AtlasPacker:
+    def __init__(self, max_size=2048, padding=0, extrude=0):
+        """
+        Pack the tiles of several tilesets into as few power-of-two atlas pages as possible.
+
+        Byte-identical tiles are only stored once, no matter which tileset they came from.
+
+        :type max_size: int
+        :param max_size: Maximum width and height of a single atlas page. Must be a power of two.
+        :type padding: int
+        :param padding: Transparent pixels left around every packed tile.
+        :type extrude: int
+        :param extrude: Number of times the border pixels of every tile are repeated outwards, to avoid bleeding when
+                        the atlas is sampled with filtering on the GPU.
+        """
+        if max_size <= 0 or max_size & (max_size - 1):
+            raise ValueError("max_size should be a power of two.")
+        self.max_size = max_size
+        self.padding = padding
+        self.extrude = extrude
+        self.tilesets = OrderedDict()
+        self.tileset_rules = {}
+
+    def add_tileset(self, name, tiles, rules=None):
+        """
+        Queue a list of tiles for packing.
+
+        :type name: str
+        :param name: Name of the tileset, used as the key in the lookup table.
+        :type tiles: list[Image]
+        :param tiles: Tiles, in the order they should appear in the lookup table.
+        :type rules: infertile.inferrer.rules.CompiledRules
+        :param rules: Rules the tiles were generated with, if they're a complete tileset in ``rules.tile_masks`` order;
+                      the tileset's lookup is then keyed by neighborhood mask - see :py:meth:`.pack`.
+        """
+        if name in self.tilesets:
+            raise ValueError("Tileset {} was already added.".format(name))
+        tiles = list(tiles)
+        if rules is not None:
+            if len(tiles) != len(rules.tile_masks):
+                raise ValueError("Tileset {} has {} tiles, but its rules have {}.".format(
+                    name, len(tiles), len(rules.tile_masks)
+                ))
+            self.tileset_rules[name] = rules
+        self.tilesets[name] = tiles
+
+    def add_generator(self, name, generator, progress=None):
+        """
+        Queue the complete tileset of a TilesetGenerator for packing.
+
+        :type name: str
+        :param name: Name of the tileset, used as the key in the lookup table.
+        :type generator: infertile.inferrer.generator.TilesetGenerator
+        :param generator: Generator with a loaded image and a box set.
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        """
+        self.add_tileset(name, generator.get_tiling_sprite_list(progress), generator.rules)
+
+    def pack(self, progress=None):
+        """
+        Pack all the queued tilesets.
+
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :return: Tuple of the list of atlas pages and the lookup table. The table maps the name of every tileset added
+                 with rules to a dictionary holding the ``normalization`` list, mapping every one of the 256
+                 neighborhood masks to a normalized one, and ``tiles``, mapping every normalized mask to the rect of
+                 its tile; and the name of every other tileset to a list of the rects its tiles occupy, in the order
+                 they were added.
+        :rtype: (list[Image], dict[str: dict|list[AtlasRect]])
+        :raises GenerationCancelled: if ``progress`` gets cancelled.
+        """
+        if progress is None:
+            progress = ProgressToken()
+        unique_tiles = OrderedDict()
+        tile_keys = OrderedDict()
+        for name, tiles in self.tilesets.items():
+            tile_keys[name] = []
+            for tile in tiles:
+                key = tile_hash(tile)
+                unique_tiles.setdefault(key, tile)
+                tile_keys[name].append(key)
+        mode = self.get_page_mode(unique_tiles.values())
+        pages, rects = self.pack_unique(unique_tiles, mode, progress)
+        lookup = OrderedDict()
+        for name, keys in tile_keys.items():
+            tileset_rects = [rects[key] for key in keys]
+            if name in self.tileset_rules:
+                rules = self.tileset_rules[name]
+                lookup[name] = OrderedDict([('normalization', list(rules.normalization)),
+                                            ('tiles', OrderedDict((str(mask), rect) for mask, rect
+                                                                  in zip(rules.tile_masks, tileset_rects)))])
+            else:
+                lookup[name] = tileset_rects
+        return pages, lookup
+
+    @staticmethod
+    def get_page_mode(tiles):
+        """
+        Pick an image mode that can hold all the tiles - their common mode, if they share one, RGBA otherwise.
+
+        :type tiles: Iterable[Image]
+        :rtype: str
+        """
+        modes = {tile.mode for tile in tiles}
+        if len(modes) == 1:
+            return modes.pop()
+        return 'RGBA'
+
+    def pack_unique(self, unique_tiles, mode, progress=None):
+        """
+        Shelf-pack deduplicated tiles into pages, tallest first.
+
+        :type unique_tiles: dict[str: Image]
+        :param unique_tiles: Dictionary mapping content hashes to tiles.
+        :type mode: str
+        :param mode: Image mode of the pages.
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :return: Tuple of the list of pages and a dictionary mapping content hashes to the rects of the tiles.
+        :rtype: (list[Image], dict[str: AtlasRect])
+        """
+        if progress is None:
+            progress = ProgressToken()
+        gutter = self.padding + self.extrude
+        order = sorted(unique_tiles, key=lambda k: (-unique_tiles[k].size[1], -unique_tiles[k].size[0]))
+        placements = []
+        rects = {}
+        page = -1
+        x, y, shelf_height = self.max_size, 0, 0
+        for key in order:
+            w, h = unique_tiles[key].size
+            cell_w, cell_h = w + 2 * gutter, h + 2 * gutter
+            if cell_w > self.max_size or cell_h > self.max_size:
+                raise ValueError("Tile of size {}x{} does not fit in a {}px atlas page.".format(w, h, self.max_size))
+            if x + cell_w > self.max_size:
+                # Start a new shelf
+                x, y, shelf_height = 0, y + shelf_height, 0
+            if page < 0 or y + cell_h > self.max_size:
+                page += 1
+                placements.append([])
+                x, y, shelf_height = 0, 0, 0
+            placements[page].append((key, x + gutter, y + gutter))
+            rects[key] = AtlasRect(page, x + gutter, y + gutter, w, h)
+            x += cell_w
+            shelf_height = max(shelf_height, cell_h)
+
+        pages = []
+        for page_placements in placements:
+            used_w = max(x + unique_tiles[key].size[0] + gutter for key, x, _ in page_placements)
+            used_h = max(y + unique_tiles[key].size[1] + gutter for key, _, y in page_placements)
+            atlas = Image.new(mode, (next_power_of_two(used_w), next_power_of_two(used_h)))
+            for key, x, y in page_placements:
+                tile = unique_tiles[key]
+                if tile.mode != mode:
+                    tile = tile.convert(mode)
+                self.extrude_tile(atlas, tile, x, y)
+                atlas.paste(tile, (x, y))
+                progress.check()
+            pages.append(atlas)
+            progress.update('pack', len(pages), len(placements))
+        return pages, rects
+
+    def extrude_tile(self, atlas, tile, x, y):
+        """
+        Repeat the border pixels of a tile ``self.extrude`` times around the place it's going to be pasted at.
+
+        :type atlas: Image
+        :type tile: Image
+        :type x: int
+        :type y: int
+        """
+        if not self.extrude:
+            return
+        w, h = tile.size
+        e = self.extrude
+        top, bottom = tile.crop((0, 0, w, 1)), tile.crop((0, h - 1, w, h))
+        left, right = tile.crop((0, 0, 1, h)), tile.crop((w - 1, 0, w, h))
+        atlas.paste(top.resize((w, e)), (x, y - e))
+        atlas.paste(bottom.resize((w, e)), (x, y + h))
+        atlas.paste(left.resize((e, h)), (x - e, y))
+        atlas.paste(right.resize((e, h)), (x + w, y))
+        for cx, cy, px, py in ((0, 0, x - e, y - e),
+                               (w - 1, 0, x + w, y - e),
+                               (0, h - 1, x - e, y + h),
+                               (w - 1, h - 1, x + w, y + h)):
+            atlas.paste(tile.getpixel((cx, cy)), (px, py, px + e, py + e))
+
+
+def tile_hash(tile):
+    """
+    Hash the contents of a tile, so that byte-identical tiles from different tilesets can be stored once.
+
+    :type tile: Image
+    :rtype: str
+    """
+    digest = hashlib.sha1()
+    digest.update("{}:{}x{}:".format(tile.mode, *tile.size).encode())
+    digest.update(tile.tobytes())
+    return digest.hexdigest()
+
+
+def next_power_of_two(n):
+    """
+    :type n: int
+    :return: The smallest power of two not smaller than n.
+    :rtype: int
+    """
+    return 1 << max(n - 1, 0).bit_length()
+
+
+def save_atlas(pages, lookup, path):
+    """
+    Save packed atlas pages next to a JSON lookup table.
+
+    Given ``path`` of ``atlas.png``, pages are saved as ``atlas_0.png``, ``atlas_1.png``, ..., and the table as
+    ``atlas.json``, holding the lookup table from :py:meth:`AtlasPacker.pack` under ``tilesets``, with every rect as
+    a ``[page, x, y, w, h]`` list.
+
+    :type pages: list[Image]
+    :type lookup: dict[str: dict|list[AtlasRect]]
+    :type path: str
+    """
+    save_pages(pages, {'tilesets': lookup}, path)
+
+
+def save_pages(pages, table, path):
+    """
+    Save atlas pages next to a JSON file holding the given table, plus the list of page file names under ``pages``.
+    Files are named like in :py:func:`save_atlas`.
+
+    :type pages: list[Image]
+    :type table: dict
+    :type path: str
+    """
+    root, ext = os.path.splitext(path)
+    page_files = []
+    for i, page in enumerate(pages):
+        page_path = "{}_{}{}".format(root, i, ext or '.png')
+        page.save(page_path)
+        page_files.append(os.path.basename(page_path))
+    contents = OrderedDict([('pages', page_files)])
+    contents.update(table)
+    with open(root + '.json', 'w') as table_file:
+        json.dump(contents, table_file, indent=2)
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# vim: ai ts=4 sts=4 et sw=4 ft=python
+#
+# # Released under MIT License
+#
+# Copyright (c) 2017 Slavfox.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+__all__ = ['MemoryProfiler', 'image_nbytes', 'get_peak_rss']
+
+
+class MemoryProfiler:
+    def __init__(self, budget=None):
+        """
+        Record memory use per stage of the generation, and optionally hold it to a budget.
+
+        Pillow allocates pixel data outside of the Python allocator, so besides what ``tracemalloc`` sees and the peak
+        RSS of the process, the profiler keeps track of the estimated size of the images the generator holds on to,
+        reported to it with :py:meth:`.record_images`. That estimate is what the budget applies to; it's deterministic,
+        so it also makes for a stable number to check in CI. Going over the budget only counts as exceeding it if the
+        images are still held after releasing what can be - see :py:meth:`.over_budget`.
+
+        :type budget: int
+        :param budget: Maximum number of bytes of images to keep around, or None for no limit.
+        """
+        self.budget = budget
+        self.stages = OrderedDict()
+        self.peak_image_bytes = 0
+        self.retained_peak_image_bytes = 0
+        self.current_stage = None
+        self.started_tracing = False
+        self.prefix = ''
+        self.held_image_bytes = 0
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    @contextmanager
+    def group(self, name, held_image_bytes=0):
+        """
+        Context manager recording the stages within it as ``<name>/<stage>``, so several generations - like the pairs
+        of a sheet - can be profiled in one report.
+
+        :type name: str
+        :type held_image_bytes: int
+        :param held_image_bytes: Bytes of images held outside of the group for all of it, like the decoded sheet; added
+                                 to every number of bytes reported within.
+        """
+        prefix, held_image_bytes_before = self.prefix, self.held_image_bytes
+        self.prefix = prefix + name + '/'
+        self.held_image_bytes = held_image_bytes_before + held_image_bytes
+        try:
+            yield
+        finally:
+            self.prefix, self.held_image_bytes = prefix, held_image_bytes_before
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager recording the memory used by one stage, like ``load``, ``parts``, ``tiles``, ``atlas`` or
+        ``encode``.
+
+        :type name: str
+        """
+        self.start()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+        record = OrderedDict([('seconds', 0.0),
+                              ('traced_bytes', 0),
+                              ('traced_peak_bytes', 0),
+                              ('image_bytes', 0),
+                              ('image_peak_bytes', 0),
+                              ('peak_rss_growth_bytes', None)])
+        self.stages[self.prefix + name] = record
+        self.current_stage = record
+        rss_start = get_peak_rss()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            traced, traced_peak = tracemalloc.get_traced_memory()
+            record['seconds'] = time.perf_counter() - start
+            record['traced_bytes'] = traced - traced_start
+            record['traced_peak_bytes'] = max(0, traced_peak - traced_start)
+            # The peak RSS only ever grows over the life of the process, so what a stage adds to it is its own.
+            rss_end = get_peak_rss()
+            if rss_end is not None:
+                record['peak_rss_growth_bytes'] = rss_end - rss_start
+            self.current_stage = None
+
+    def record_images(self, nbytes):
+        """
+        Report how many bytes of images are held once everything the budget calls for has been released.
+
+        :type nbytes: int
+        """
+        nbytes += self.held_image_bytes
+        self.update_peaks(nbytes)
+        self.retained_peak_image_bytes = max(self.retained_peak_image_bytes, nbytes)
+        if self.current_stage is not None:
+            self.current_stage['image_bytes'] = nbytes
+
+    def observe_images(self, nbytes):
+        """
+        Report how many bytes of images are momentarily held, counting only towards the raw peak.
+
+        :type nbytes: int
+        """
+        self.update_peaks(nbytes + self.held_image_bytes)
+
+    def over_budget(self, nbytes):
+        """
+        Report how many bytes of images are momentarily held, and check them against the budget. The caller is
+        expected to release what it can if they're over it, and then report what's left with :py:meth:`.record_images`.
+
+        :type nbytes: int
+        :rtype: bool
+        """
+        nbytes += self.held_image_bytes
+        self.update_peaks(nbytes)
+        return self.budget is not None and nbytes > self.budget
+
+    def update_peaks(self, nbytes):
+        self.peak_image_bytes = max(self.peak_image_bytes, nbytes)
+        if self.current_stage is not None:
+            self.current_stage['image_peak_bytes'] = max(self.current_stage['image_peak_bytes'], nbytes)
+
+    @property
+    def exceeded(self):
+        """
+        Whether the images held at some point went over the budget, even after releasing everything that could be.
+        """
+        return self.budget is not None and self.retained_peak_image_bytes > self.budget
+
+    def report(self):
+        """
+        :return: Dictionary of the recorded numbers, ready to be dumped to JSON.
+        :rtype: dict
+        """
+        return OrderedDict([('budget_bytes', self.budget),
+                            ('exceeded', self.exceeded),
+                            ('peak_image_bytes', self.peak_image_bytes),
+                            ('retained_peak_image_bytes', self.retained_peak_image_bytes),
+                            # Over the whole life of the process, not just the profiled stages.
+                            ('process_peak_rss_bytes', get_peak_rss()),
+                            ('stages', self.stages)])
+
+    def save_report(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+
+def image_nbytes(image):
+    """
+    Estimate how much memory Pillow uses for the pixels of an image.
+
+    :type image: Image
+    :rtype: int
+    """
+    if image.mode in ('1', 'L', 'P'):
+        pixel_size = 1
+    elif image.mode.startswith('I;16'):
+        pixel_size = 2
+    else:
+        # Multi-band modes are stored as 4 bytes per pixel, as are 32-bit ones.
+        pixel_size = 4
+    return image.size[0] * image.size[1] * pixel_size
+
+
+def get_peak_rss():
+    """
+    :return: Peak resident set size of the process in bytes, or None if it can't be measured on this platform.
+    :rtype: int|None
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return peak if sys.platform == 'darwin' else peak * 1024
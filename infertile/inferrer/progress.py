@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# vim: ai ts=4 sts=4 et sw=4 ft=python
+#
+# # Released under MIT License
+#
+# Copyright (c) 2017 Slavfox.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import threading
+import time
+
+__all__ = ['GenerationCancelled', 'ProgressToken']
+
+
+class GenerationCancelled(Exception):
+    """
+    Raised from inside the generation API once its ProgressToken has been cancelled.
+    """
+
+
+class ProgressToken:
+    def __init__(self, callback=None, min_interval=0.1):
+        """
+        Token passed through the generation API to report progress and to cancel it from another thread.
+
+        :type callback: callable
+        :param callback: Called with ``(stage, done, total)``, where ``stage`` is one of ``parts``, ``tiles``,
+                         ``scales``, ``atlas``, ``map``, ``pack`` or ``batch``. Calls are throttled to at most one per
+                         ``min_interval`` seconds, but the first and last update of every stage always get through.
+        :type min_interval: float
+        :param min_interval: Minimum number of seconds between two callback calls.
+        """
+        self.callback = callback
+        self.min_interval = min_interval
+        self.last_report = None
+        self.last_stage = None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        Request the work using this token to stop. Safe to call from any thread; the work stops at the next update.
+        """
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        """
+        :raises GenerationCancelled: if the token has been cancelled.
+        """
+        if self._cancelled.is_set():
+            raise GenerationCancelled()
+
+    def update(self, stage, done, total):
+        """
+        Report progress, stopping the work if the token has been cancelled.
+
+        :type stage: str
+        :param stage: Name of the stage of the work being done.
+        :type done: int
+        :param done: Number of finished items in this stage.
+        :type total: int
+        :param total: Total number of items in this stage.
+        :raises GenerationCancelled: if the token has been cancelled.
+        """
+        self.check()
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if (stage != self.last_stage or done >= total or self.last_report is None
+                or now - self.last_report >= self.min_interval):
+            self.last_report = now
+            self.last_stage = stage
+            self.callback(stage, done, total)
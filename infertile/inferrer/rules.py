@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# vim: ai ts=4 sts=4 et sw=4 ft=python
+#
+# # Released under MIT License
+#
+# Copyright (c) 2017 Slavfox.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+from collections import OrderedDict, namedtuple
+
+__all__ = ['PartSource', 'CompiledRules', 'compile_rules', 'load_rules', 'BLOB_47_SPEC', 'BLOB_47', 'POSITIONS']
+
+
+# Bit of every neighbor in a neighborhood mask, matching Neighborhood.to_int.
+NEIGHBOR_BITS = OrderedDict((('ul', 128), ('um', 64), ('ur', 32),
+                             ('ml', 16),              ('mr', 8),
+                             ('dl', 4),  ('dm', 2),   ('dr', 1)))
+
+# The nine sections of a tile, in left-to-right, top-to-bottom order.
+POSITIONS = ('ul', 'um', 'ur', 'ml', 'mm', 'mr', 'dl', 'dm', 'dr')
+
+# What a section of a tile is made of: a part from TilesetGenerator.parts, either as-is or stretched over the section
+# with TilesetGenerator.get_fill.
+PartSource = namedtuple('PartSource', ('part', 'fill'))
+
+# Pieces a corner rule can ``use``, as templates of the part they take and whether it's stretched.
+CORNER_PIECES = {
+    'concave-corner': ('concave{umd}{lmr}', False),
+    'convex-corner': ('convex{umd}{lmr}', False),
+    'fill-middle': ('concavemm', True),
+    'vertical-edge': ('convexm{lmr}', True),
+    'horizontal-edge': ('convex{umd}m', True),
+}
+
+CORNER_CONDITIONS = ('diagonal', 'vertical', 'horizontal')
+
+MAP_EDGES = ('empty', 'filled')
+
+# The built-in 47-tile ("blob") behavior.
+BLOB_47_SPEC = {
+    'name': 'blob47',
+    # Middle of the tile: "convex" or "concave".
+    'center': 'convex',
+    # Sprite half the top, bottom, left and right edges are taken from, depending on whether the neighbor there is
+    # filled. Can also be given separately for each of "um", "ml", "mr" and "dm".
+    'edges': {'filled': 'concave', 'empty': 'convex'},
+    # Rules for the corners, the first one matching the diagonal, vertical and horizontal neighbors of a corner wins;
+    # conditions left out match anything. Can also be given separately for each of "ul", "ur", "dl" and "dr".
+    'corners': [
+        {'diagonal': False, 'vertical': True, 'horizontal': True, 'use': 'concave-corner'},
+        {'vertical': True, 'horizontal': True, 'use': 'fill-middle'},
+        {'vertical': True, 'use': 'vertical-edge'},
+        {'horizontal': True, 'use': 'horizontal-edge'},
+        {'use': 'convex-corner'},
+    ],
+    # Whether cells outside of a map count as "empty" or "filled" neighbors.
+    'map_edge': 'empty',
+}
+
+
+class CompiledRules:
+    def __init__(self, name, compositions, normalization, map_edge):
+        """
+        Autotiling rules compiled into lookup tables. Use :py:func:`compile_rules` to make one.
+
+        :type name: str
+        :type compositions: dict[int: tuple[PartSource]]
+        :param compositions: Dictionary mapping every normalized neighborhood mask to the sources of the nine sections
+                             of its tile, in :py:data:`POSITIONS` order.
+        :type normalization: list[int]
+        :param normalization: List mapping every one of the 256 neighborhood masks to its normalized mask.
+        :type map_edge: str
+        :param map_edge: One of :py:data:`MAP_EDGES`.
+        """
+        self.name = name
+        self.compositions = compositions
+        self.normalization = normalization
+        self.map_edge = map_edge
+        # Same order as the set of Neighborhoods the tileset was originally built from, to keep the atlases stable.
+        self.tile_masks = sorted({normalization[mask] for mask in range(255, -1, -1)},
+                                 key=lambda mask: bin(mask).count('1'))
+        self.tile_indices = {mask: i for i, mask in enumerate(self.tile_masks)}
+
+    def __repr__(self):
+        return "CompiledRules: {} ({} tiles)".format(self.name, len(self.tile_masks))
+
+    def normalize(self, mask):
+        """
+        :type mask: int
+        :rtype: int
+        """
+        return self.normalization[mask]
+
+    def get_composition(self, mask):
+        """
+        :type mask: int
+        :param mask: Neighborhood mask, normalized or not.
+        :return: Sources of the nine sections of the tile, in :py:data:`POSITIONS` order.
+        :rtype: tuple[PartSource]
+        """
+        return self.compositions[self.normalization[mask]]
+
+    def get_map_masks(self, grid):
+        """
+        Get the normalized neighborhood mask of every filled cell of a map.
+
+        :type grid: list[list[bool]]
+        :param grid: Rows of cells, truthy where filled.
+        :return: Rows of normalized masks, None for empty cells.
+        :rtype: list[list[int|None]]
+        """
+        height = len(grid)
+        width = len(grid[0]) if height else 0
+        edge = self.map_edge == 'filled'
+        # Pad the map by one cell on every side, so every lookup below is in bounds.
+        padded = [[edge] * (width + 2)]
+        padded += [[edge] + [bool(cell) for cell in row] + [edge] for row in grid]
+        padded += [[edge] * (width + 2)]
+        masks = []
+        for y in range(1, height + 1):
+            above, row, below = padded[y - 1], padded[y], padded[y + 1]
+            masks.append([self.normalization[above[x - 1] << 7 | above[x] << 6 | above[x + 1] << 5 |
+                                             row[x - 1] << 4 | row[x + 1] << 3 |
+                                             below[x - 1] << 2 | below[x] << 1 | below[x + 1]]
+                          if row[x] else None
+                          for x in range(1, width + 1)])
+        return masks
+
+
+def compile_rules(spec):
+    """
+    Compile a declarative rule set, formatted like :py:data:`BLOB_47_SPEC`, into lookup tables.
+
+    Neighborhoods whose tiles would be made of exactly the same sections are normalized to a single mask - the one
+    with the fewest neighbors - so no tile is ever generated twice.
+
+    :type spec: dict
+    :rtype: CompiledRules
+    """
+    center = spec.get('center', 'convex')
+    if center not in ('convex', 'concave'):
+        raise ValueError("center should be either convex or concave, got {}.".format(center))
+    map_edge = spec.get('map_edge', 'empty')
+    if map_edge not in MAP_EDGES:
+        raise ValueError("map_edge should be one of: {}, got {}.".format(", ".join(MAP_EDGES), map_edge))
+    edges = spec.get('edges', BLOB_47_SPEC['edges'])
+    if 'filled' in edges:
+        edges = {position: edges for position in ('um', 'ml', 'mr', 'dm')}
+    missing = [position for position in ('um', 'ml', 'mr', 'dm') if position not in edges]
+    if missing:
+        raise ValueError("No edge rules for: {}.".format(", ".join(missing)))
+    if 'corners' not in spec:
+        raise ValueError("Rule sets should have corner rules.")
+    corners = spec['corners']
+    if isinstance(corners, list):
+        corners = {position: corners for position in ('ul', 'ur', 'dl', 'dr')}
+    missing = [position for position in ('ul', 'ur', 'dl', 'dr') if position not in corners]
+    if missing:
+        raise ValueError("No corner rules for: {}.".format(", ".join(missing)))
+
+    sections = {'mm': lambda mask: PartSource(center + 'mm', False)}
+    for position in ('um', 'ml', 'mr', 'dm'):
+        sections[position] = compile_edge(position, edges[position])
+    for position in ('ul', 'ur', 'dl', 'dr'):
+        sections[position] = compile_corner(position, corners[position])
+
+    compositions_by_mask = [tuple(sections[position](mask) for position in POSITIONS) for mask in range(256)]
+    representatives = {}
+    for mask in sorted(range(256), key=lambda m: (bin(m).count('1'), m)):
+        representatives.setdefault(compositions_by_mask[mask], mask)
+    normalization = [representatives[compositions_by_mask[mask]] for mask in range(256)]
+    compositions = {mask: compositions_by_mask[mask] for mask in set(normalization)}
+    return CompiledRules(spec.get('name', 'custom'), compositions, normalization, map_edge)
+
+
+def compile_edge(position, edge_rule):
+    """
+    :return: Function mapping a neighborhood mask to the source of the given edge section.
+    :rtype: callable
+    """
+    if not isinstance(edge_rule, dict):
+        raise ValueError("Edge {} should be described by a filled/empty mapping.".format(position))
+    for key in ('filled', 'empty'):
+        if edge_rule.get(key) not in ('convex', 'concave'):
+            raise ValueError("Edge {} should map {} to either convex or concave.".format(position, key))
+    bit = NEIGHBOR_BITS[position]
+    filled = PartSource(edge_rule['filled'] + position, False)
+    empty = PartSource(edge_rule['empty'] + position, False)
+    return lambda mask: filled if mask & bit else empty
+
+
+def compile_corner(position, corner_rules):
+    """
+    :return: Function mapping a neighborhood mask to the source of the given corner section.
+    :rtype: callable
+    """
+    umd, lmr = position
+    bits = {'diagonal': NEIGHBOR_BITS[position],
+            'vertical': NEIGHBOR_BITS[umd + 'm'],
+            'horizontal': NEIGHBOR_BITS['m' + lmr]}
+    compiled = []
+    for rule in corner_rules:
+        unknown = set(rule) - set(CORNER_CONDITIONS) - {'use'}
+        if unknown:
+            raise ValueError("Unknown corner rule conditions: {}.".format(", ".join(sorted(unknown))))
+        if rule.get('use') not in CORNER_PIECES:
+            raise ValueError("Corner rules should use one of: {}, got {}.".format(", ".join(sorted(CORNER_PIECES)),
+                                                                                rule.get('use')))
+        template, fill = CORNER_PIECES[rule['use']]
+        conditions = [(bits[condition], bool(rule[condition])) for condition in CORNER_CONDITIONS
+                      if condition in rule]
+        compiled.append((conditions, PartSource(template.format(umd=umd, lmr=lmr), fill)))
+
+    def corner(mask):
+        for conditions, source in compiled:
+            if all(bool(mask & bit) == expected for bit, expected in conditions):
+                return source
+        raise ValueError("No corner rule for {} matches neighborhood {:08b}.".format(position, mask))
+    return corner
+
+
+def load_rules(path):
+    """
+    Load and compile a rule set from a JSON file, formatted like :py:data:`BLOB_47_SPEC`.
+
+    :param path: Path to the JSON file.
+    :rtype: CompiledRules
+    """
+    with open(path) as rules_file:
+        return compile_rules(json.load(rules_file))
+
+
+BLOB_47 = compile_rules(BLOB_47_SPEC)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# vim: ai ts=4 sts=4 et sw=4 ft=python
+#
+# # Released under MIT License
+#
+# Copyright (c) 2017 Slavfox.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import json
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from infertile.inferrer.generator import TilesetGenerator, Box
+from infertile.inferrer.progress import ProgressToken
+from infertile.inferrer.rules import BLOB_47
+
+__all__ = ['SheetRegion', 'SpriteSheet', 'load_regions']
+
+
+# ``region`` is the part of the sheet holding a convex/concave pair, ``box`` the center box within each of its halves.
+SheetRegion = namedtuple('SheetRegion', ('name', 'region', 'box'))
+
+
+class SpriteSheet:
+    def __init__(self, source_path):
+        """
+        A sheet of several convex/concave pairs, each laid out like the input of
+        :py:meth:`TilesetGenerator.load_image`. The sheet is decoded once, and every pair is generated from a crop of
+        the decoded image.
+
+        :param source_path: Path to the image.
+        """
+        self.source_img = Image.open(source_path)
+        self.source_img.load()
+        self.fill_mode = 'resize'
+        self.rules = BLOB_47
+
+    def grid_regions(self, cell_size, box, skip_empty=True):
+        """
+        Describe a sheet laid out as a regular grid of pairs, all using the same center box.
+
+        :type cell_size: (int, int)
+        :param cell_size: Width and height of a grid cell, holding a whole pair - so the width is two sprites wide.
+        :type box: Box
+        :param box: Center box of every sprite, relative to the top left corner of its half of the cell.
+        :type skip_empty: bool
+        :param skip_empty: Whether to leave out cells that are completely empty (transparent/black).
+        :return: Regions of all the cells, named ``<row>_<column>``, in left-to-right, top-to-bottom order.
+        :rtype: list[SheetRegion]
+        """
+        cell_w, cell_h = cell_size
+        if cell_w <= 0 or cell_h <= 0:
+            raise ValueError("Cell size should be positive.")
+        if cell_w % 2 != 0:
+            raise ValueError("Cells should be split into two equal parts - cell width is not even.")
+        regions = []
+        for row in range(self.source_img.size[1] // cell_h):
+            for column in range(self.source_img.size[0] // cell_w):
+                region = Box(column * cell_w, row * cell_h, (column + 1) * cell_w, (row + 1) * cell_h)
+                if skip_empty and self.source_img.crop(region).getbbox() is None:
+                    continue
+                regions.append(SheetRegion("{}_{}".format(row, column), region, box))
+        return regions
+
+    def get_generator(self, region):
+        """
+        Make a generator for a single pair of the sheet.
+
+        :type region: SheetRegion
+        :rtype: TilesetGenerator
+        """
+        generator = TilesetGenerator()
+        generator.set_image(self.source_img.crop(region.region))
+        generator.box = region.box
+        generator.fill_mode = self.fill_mode
+        generator.rules = self.rules
+        return generator
+
+    def map_regions(self, regions, func, workers=1, progress=None):
+        """
+        Call a function with the generator of every region, optionally in parallel.
+
+        :type regions: list[SheetRegion]
+        :type func: callable
+        :param func: Function taking a TilesetGenerator; its return values are collected.
+        :type workers: int
+        :param workers: Number of threads to use.
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation. The callback may get called from
+                         the worker threads.
+        :return: Dictionary mapping region names to what ``func`` returned for them, in the order of ``regions``.
+        :rtype: dict[str: object]
+        :raises GenerationCancelled: if ``progress`` gets cancelled.
+        """
+        if progress is None:
+            progress = ProgressToken()
+        if len({region.name for region in regions}) != len(regions):
+            raise ValueError("Region names should be unique.")
+        results = OrderedDict((region.name, None) for region in regions)
+
+        def run(region):
+            progress.check()
+            return func(self.get_generator(region))
+
+        if workers > 1:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [(region.name, executor.submit(run, region)) for region in regions]
+                try:
+                    for done, (name, future) in enumerate(futures, start=1):
+                        results[name] = future.result()
+                        progress.update('batch', done, len(regions))
+                finally:
+                    for _, future in futures:
+                        future.cancel()
+        else:
+            for done, region in enumerate(regions, start=1):
+                results[region.name] = run(region)
+                progress.update('batch', done, len(regions))
+        return results
+
+    def get_tilesets(self, regions, workers=1, progress=None):
+        """
+        Generate the tile lists of several pairs.
+
+        :return: Dictionary mapping region names to lists of tiles, like from
+                 :py:meth:`TilesetGenerator.get_tiling_sprite_list`.
+        :rtype: dict[str: list[Image]]
+        """
+        return self.map_regions(regions, lambda generator: generator.get_tiling_sprite_list(progress),
+                                workers, progress)
+
+    def get_atlases(self, regions, scales=(1,), workers=1, progress=None):
+        """
+        Generate one merged tileset image per pair, at each of the given scales.
+
+        :return: Dictionary mapping region names to dictionaries mapping scales to images, like from
+                 :py:meth:`TilesetGenerator.get_scaled_atlases`.
+        :rtype: dict[str: dict[int|float: Image]]
+        """
+        return self.map_regions(regions, lambda generator: generator.get_scaled_atlases(scales, progress),
+                                workers, progress)
+
+    def pack(self, regions, packer, workers=1, progress=None):
+        """
+        Generate several pairs and pack all their tiles together.
+
+        :type packer: infertile.inferrer.packer.AtlasPacker
+        :return: Atlas pages and lookup table, like from :py:meth:`AtlasPacker.pack`, keyed by neighborhood mask.
+        :rtype: (list[Image], dict[str: dict])
+        """
+        for name, tiles in self.get_tilesets(regions, workers, progress).items():
+            packer.add_tileset(name, tiles, self.rules)
+        return packer.pack(progress)
+
+
+def load_regions(path):
+    """
+    Load an explicit list of regions from a JSON file, formatted like::
+
+        [
+            {"name": "grass", "region": [0, 0, 64, 32], "box": [8, 8, 24, 24]},
+            {"name": "sand", "region": [64, 0, 112, 24], "box": [4, 4, 20, 20]}
+        ]
+
+    :param path: Path to the JSON file.
+    :rtype: list[SheetRegion]
+    """
+    with open(path) as regions_file:
+        entries = json.load(regions_file)
+    return [SheetRegion(entry['name'], Box(*entry['region']), Box(*entry['box'])) for entry in entries]
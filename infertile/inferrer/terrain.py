@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# coding=utf-8
+# vim: ai ts=4 sts=4 et sw=4 ft=python
+#
+# # Released under MIT License
+#
+# Copyright (c) 2017 Slavfox.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from collections import Counter, OrderedDict, namedtuple
+
+from PIL import Image
+
+from infertile.inferrer.neighborhood import Neighborhood
+from infertile.inferrer.progress import ProgressToken
+from infertile.inferrer.rules import NEIGHBOR_BITS, POSITIONS
+
+__all__ = ['TransitionKey', 'TerrainSet']
+
+
+# A transition tile: the tile of ``terrain`` for the normalized ``mask`` of same-terrain neighbors, drawn over the
+# terrains in ``underlays`` - one per section of the tile other than the middle, in POSITIONS order, None if nothing
+# shows through there.
+TransitionKey = namedtuple('TransitionKey', ('terrain', 'mask', 'underlays'))
+
+# Neighbors looked at, in order, to pick the terrain showing through each section of a tile.
+UNDERLAY_SOURCES = {position: (position,) if 'm' in position else (position, position[0] + 'm', 'm' + position[1])
+                    for position in POSITIONS if position != 'mm'}
+
+
+class TerrainSet:
+    def __init__(self, generators, cache_size=256):
+        """
+        Several terrains meeting on one map. Every cell of a map holds a terrain id (or None, for nothing), and its
+        tile is the one of its own terrain, with the neighboring terrains showing through wherever it doesn't cover the
+        whole cell. Transition tiles are only generated when asked for, and the most recently used ones are cached.
+
+        :type generators: dict[object: infertile.inferrer.generator.TilesetGenerator]
+        :param generators: Dictionary mapping terrain ids to generators with loaded images and boxes set. All the
+                           terrains must have the same tile size.
+        :type cache_size: int
+        :param cache_size: Maximum number of transition tiles kept in the cache.
+        """
+        sizes = {(int(generator.w / 2), generator.h) for generator in generators.values()}
+        if len(sizes) != 1:
+            raise ValueError("All the terrains should have the same tile size.")
+        self.generators = generators
+        self.tile_size = sizes.pop()
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_transition_key(self, terrain, neighbors):
+        """
+        Describe the tile needed for a cell, given the terrains around it.
+
+        :param terrain: Terrain id of the cell.
+        :type neighbors: list
+        :param neighbors: Terrain ids of the 8 neighbors, in left-to-right, top-to-bottom order; None for no terrain.
+        :rtype: TransitionKey
+        """
+        neighbors = dict(zip(NEIGHBOR_BITS, neighbors))
+        mask = 0
+        for position, bit in NEIGHBOR_BITS.items():
+            if neighbors[position] == terrain:
+                mask |= bit
+        mask = self.generators[terrain].rules.normalize(mask)
+        underlays = []
+        for position in POSITIONS:
+            if position == 'mm':
+                continue
+            # The first neighbor next to the section that's a different terrain shows through it.
+            underlays.append(next((neighbors[source] for source in UNDERLAY_SOURCES[position]
+                                   if neighbors[source] is not None and neighbors[source] != terrain), None))
+        return TransitionKey(terrain, mask, tuple(underlays))
+
+    def get_tile(self, key):
+        """
+        Get a transition tile, generating it if it isn't cached.
+
+        :type key: TransitionKey
+        :rtype: Image
+        """
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        tile = self.compose_tile(key)
+        self.cache[key] = tile
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return tile
+
+    def compose_tile(self, key):
+        """
+        Generate a transition tile: the center terrain's tile for the mask, drawn over the matching sections of the
+        fully surrounded tiles of the terrains showing through.
+
+        :type key: TransitionKey
+        :rtype: Image
+        """
+        generator = self.generators[key.terrain]
+        tile = generator.get_tile(Neighborhood.from_int(key.mask, normalize=False)).convert('RGBA')
+        if all(underlay is None for underlay in key.underlays):
+            return tile
+        xs = (0, generator.box.x1, generator.box.x2, self.tile_size[0])
+        ys = (0, generator.box.y1, generator.box.y2, self.tile_size[1])
+        sections = {umd + lmr: (xs[x], ys[y], xs[x + 1], ys[y + 1])
+                    for y, umd in enumerate("umd") for x, lmr in enumerate("lmr")}
+        result = Image.new('RGBA', self.tile_size)
+        underlays = dict(zip((position for position in POSITIONS if position != 'mm'), key.underlays))
+        for position, underlay in underlays.items():
+            if underlay is None:
+                continue
+            # Every section is fully covered in the tile of a terrain surrounded by itself on all sides.
+            filled = self.generators[underlay].get_tile(Neighborhood.from_int(255, normalize=False))
+            section = sections[position]
+            result.paste(filled.crop(section).convert('RGBA'), section[:2])
+        return Image.alpha_composite(result, tile)
+
+    def get_map_keys(self, grid):
+        """
+        Describe the tile needed for every cell of a map.
+
+        :type grid: list[list]
+        :param grid: Rows of terrain ids, None for cells with no terrain.
+        :return: Rows of transition keys, None for cells with no terrain.
+        :rtype: list[list[TransitionKey|None]]
+        """
+        height = len(grid)
+        width = len(grid[0]) if height else 0
+        keys = []
+        for y in range(height):
+            row = []
+            for x in range(width):
+                terrain = grid[y][x]
+                if terrain is None:
+                    row.append(None)
+                    continue
+                # Cells outside of the map count as the terrain itself if its rules say the edge is filled.
+                outside = terrain if self.generators[terrain].rules.map_edge == 'filled' else None
+                neighbors = [grid[ny][nx] if 0 <= ny < height and 0 <= nx < width else outside
+                             for ny in (y - 1, y, y + 1) for nx in (x - 1, x, x + 1) if (nx, ny) != (x, y)]
+                row.append(self.get_transition_key(terrain, neighbors))
+            keys.append(row)
+        return keys
+
+    def required_combinations(self, grid):
+        """
+        Pre-scan a map for the transition tiles it needs, so asset builds can bake only those.
+
+        :type grid: list[list]
+        :param grid: Rows of terrain ids, None for cells with no terrain.
+        :return: Counter of how many cells use every transition tile.
+        :rtype: Counter[TransitionKey]
+        """
+        return Counter(key for row in self.get_map_keys(grid) for key in row if key is not None)
+
+    def bake(self, keys, progress=None):
+        """
+        Generate a set of transition tiles, bypassing the cache.
+
+        :type keys: Iterable[TransitionKey]
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :return: Dictionary mapping the keys to their tiles, in the order given.
+        :rtype: dict[TransitionKey: Image]
+        :raises GenerationCancelled: if ``progress`` gets cancelled.
+        """
+        if progress is None:
+            progress = ProgressToken()
+        keys = list(keys)
+        tiles = OrderedDict()
+        for key in keys:
+            tiles[key] = self.compose_tile(key)
+            progress.update('tiles', len(tiles), len(keys))
+        return tiles
+
+    def render_map(self, grid, progress=None):
+        """
+        Render a map of several terrains, generating only the transition tiles it uses.
+
+        :type grid: list[list]
+        :param grid: Rows of terrain ids, None for cells with no terrain.
+        :type progress: ProgressToken
+        :param progress: Token to report progress to, and to check for cancellation.
+        :return: RGBA image of the map, with cells with no terrain left transparent.
+        :rtype: Image
+        :raises GenerationCancelled: if ``progress`` gets cancelled.
+        """
+        if progress is None:
+            progress = ProgressToken()
+        keys = self.get_map_keys(grid)
+        tilewidth, tileheight = self.tile_size
+        result = Image.new('RGBA', (tilewidth * (len(keys[0]) if keys else 0), tileheight * len(keys)))
+        for y, row in enumerate(keys):
+            for x, key in enumerate(row):
+                if key is not None:
+                    result.paste(self.get_tile(key), (x * tilewidth, y * tileheight))
+            progress.update('map', y + 1, len(keys))
+        return result
@@ -24,9 +24,12 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import threading
+
 import wx
 
 from infertile.inferrer.generator import TilesetGenerator, Box
+from infertile.inferrer.progress import GenerationCancelled, ProgressToken
 
 ABOUT_DIALOG = """InferTile {version}
 
@@ -43,6 +46,7 @@ class InfertileFrame(wx.Frame):
 
         self.generator = TilesetGenerator()
         self.inferred_img = None
+        self.progress = None
 
         self.menu_bar = None
         self.make_menu_bar()
@@ -71,6 +75,7 @@ class InfertileFrame(wx.Frame):
         self.open_file_button = None
         self.save_button = None
         self.make_tileset_button = None
+        self.cancel_button = None
         self.zoomin_button = None
         self.zoomout_button = None
         self.scale = 1
@@ -102,6 +107,9 @@ class InfertileFrame(wx.Frame):
         self.make_tileset_button = wx.Button(self, wx.ID_ANY, 'Infer tiles')
         self.make_tileset_button.Bind(wx.EVT_BUTTON, self.on_infer)
         self.make_tileset_button.Disable()
+        self.cancel_button = wx.Button(self, wx.ID_ANY, 'Cancel')
+        self.cancel_button.Bind(wx.EVT_BUTTON, self.on_cancel)
+        self.cancel_button.Disable()
         self.zoomin_button = wx.Button(self, wx.ID_ANY, 'Zoom x2')
         self.zoomin_button.Bind(wx.EVT_BUTTON, self.on_zoomin)
         self.zoomin_button.Disable()
@@ -136,6 +144,7 @@ class InfertileFrame(wx.Frame):
         self.make_buttons()
         self.buttons_sizer.Add(self.open_file_button, 0, wx.EXPAND | wx.ALL, 5)
         self.buttons_sizer.Add(self.make_tileset_button, 0, wx.EXPAND | wx.ALL, 5)
+        self.buttons_sizer.Add(self.cancel_button, 0, wx.EXPAND | wx.ALL, 5)
 
         self.editor_sizer = wx.BoxSizer(wx.VERTICAL)
         self.make_editor()
@@ -146,6 +155,7 @@ class InfertileFrame(wx.Frame):
         self.editor_sizer.Add(self.zoomout_button, 0, wx.EXPAND | wx.ALL, 5)
 
         self.Bind(wx.EVT_PAINT, self.OnPaint)
+        self.Bind(wx.EVT_CLOSE, self.on_close)
 
         # self.preview_dc = wx.MemoryDC()
 
@@ -180,15 +190,64 @@ class InfertileFrame(wx.Frame):
     def on_exit(self, _):
         self.Close(True)  # Close the frame
 
+    def on_close(self, event):
+        if self.progress:
+            self.progress.cancel()
+        event.Skip()
+
     def on_infer(self, _):
-        self.generator.load_image(self.filename)
-        tilelist = self.generator.get_tiling_sprite_list()
-        self.inferred_img = self.generator.get_tilelist_merged_into_single_image(tilelist)
+        # Whatever is still being generated is for an outdated image or box.
+        if self.progress:
+            self.progress.cancel()
+        # The callback runs on the worker thread; hand the update over to the UI thread.
+        progress = ProgressToken(lambda stage, done, total: wx.CallAfter(self.on_progress, progress,
+                                                                         stage, done, total))
+        self.progress = progress
+        self.cancel_button.Enable()
+        worker = threading.Thread(target=self.infer_tiles, args=(progress, self.filename, self.generator.box))
+        worker.daemon = True
+        worker.start()
+
+    def infer_tiles(self, progress, filename, box):
+        """
+        Generate the tileset on a worker thread, with a generator of its own, so the UI can keep changing the box.
+        """
+        generator = TilesetGenerator()
+        try:
+            generator.load_image(filename)
+            generator.box = box
+            tilelist = generator.get_tiling_sprite_list(progress)
+            inferred_img = generator.get_tilelist_merged_into_single_image(tilelist, progress)
+        except GenerationCancelled:
+            wx.CallAfter(self.on_infer_done, progress, None, "Cancelled")
+        except Exception as e:
+            wx.CallAfter(self.on_infer_done, progress, None, "Could not infer tiles: {}".format(e))
+        else:
+            wx.CallAfter(self.on_infer_done, progress, inferred_img, "")
+
+    def on_infer_done(self, progress, inferred_img, status):
+        if progress is not self.progress:
+            # Superseded by a newer run.
+            return
+        self.progress = None
+        self.cancel_button.Disable()
+        self.SetStatusText(status)
+        if inferred_img is None:
+            return
+        self.inferred_img = inferred_img
         wximg = pil_image_to_wximg(self.inferred_img).Scale(384, 512, wx.IMAGE_QUALITY_HIGH)
         self.preview_image.SetBitmap(wx.Bitmap(wximg))
         self.save_button.Enable()
         self.redraw()
 
+    def on_cancel(self, _):
+        if self.progress:
+            self.progress.cancel()
+
+    def on_progress(self, progress, stage, done, total):
+        if progress is self.progress:
+            self.SetStatusText("Generating {}: {}/{}".format(stage, done, total))
+
     def redraw(self):
         self.preview_sizer.Fit(self)
         self.preview_sizer.Layout()